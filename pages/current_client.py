@@ -1,29 +1,12 @@
 import streamlit as st
 import pandas as pd
-import altair as alt
 from datetime import datetime
-import hmac
-import os
-from pathlib import Path
-
-## Password check remains unchanged.
-def check_password():
-    """Returns `True` if the user had the correct password."""
-    def password_entered():
-        """Checks whether a password entered by the user is correct."""
-        if hmac.compare_digest(st.session_state["password"], st.secrets["password"]):
-            st.session_state["password_correct"] = True
-            del st.session_state["password"]  # Don't store the password.
-        else:
-            st.session_state["password_correct"] = False
-
-    if st.session_state.get("password_correct", False):
-        return True
-
-    st.text_input("Password", type="password", on_change=password_entered, key="password")
-    if "password_correct" in st.session_state and not st.session_state["password_correct"]:
-        st.error("😕 Password incorrect")
-    return False
+
+from utils import (
+    CLIENT_REQUIRED_COLUMNS, MONTH_NAMES, add_months, check_password, client_monthly_totals, client_options,
+    commodity_options, get_cost_divisor, get_data_path, get_rates_csv, load_client_index, load_monthly_rates,
+    load_rates, monthly_breakdown, monthly_cost_breakdown, province_options, site_options
+)
 
 if not check_password():
     st.stop()
@@ -31,37 +14,6 @@ if not check_password():
 # Display the logo
 st.image("assets/portfoliopartnerslogo.png", width=800)
 
-# --- Helper Functions ---
-
-def get_data_path(filename):
-    """
-    Returns the absolute path to a data file based on its expected location:
-      - If the file is "client_data_by_site.csv", it is assumed to be in the repository root.
-      - If the filename starts with "historical_", it is assumed to be in the 'market-data' folder.
-      - Otherwise, the file is assumed to be in a 'data' folder at the repository root.
-    """
-    BASE_DIR = Path(__file__).resolve().parent.parent
-    if filename == "client_data_by_site.csv":
-        return str(BASE_DIR / filename)
-    elif filename.startswith("historical_"):
-        return str(BASE_DIR / "market-data" / filename)
-    else:
-        return str(BASE_DIR / "data" / filename)
-
-def get_rates_csv(province, commodity):
-    """
-    Returns the appropriate CSV filename based on the province and commodity.
-    """
-    if province == "Alberta" and commodity == "gas":
-        return "historical_data_AB_gas.csv"
-    elif province == "Alberta" and commodity == "electricity":
-        return "historical_data_AB_ele.csv"
-    elif province == "Ontario" and commodity == "gas":
-        return "historical_data_ON_gas.csv"
-    else:
-        st.error(f"No rate file rule for province={province}, commodity={commodity}")
-        st.stop()
-
 # --- Main Application Function ---
 def main():
     st.title("Market Performance Simulator (CAD) - Existing Clients (Multi-Site)")
@@ -77,45 +29,31 @@ def main():
     #### 1. Load the client site-level CSV ####
     csv_path_client = get_data_path("client_data_by_site.csv")
     try:
-        client_df = pd.read_csv(csv_path_client)
+        client_index = load_client_index(csv_path_client, CLIENT_REQUIRED_COLUMNS)
     except FileNotFoundError:
         st.error(f"Could not find '{csv_path_client}'. Please ensure it exists.")
         st.stop()
 
-    expected_cols = {
-        "client_name", "site_ID", "province", "commodity",
-        "contract_start_date", "client_admin_fee",
-        "January", "February", "March", "April", "May", "June",
-        "July", "August", "September", "October", "November", "December"
-    }
-    if not expected_cols.issubset(client_df.columns):
-        st.error(f"The file '{csv_path_client}' is missing required columns: {expected_cols}")
-        st.stop()
-
     # 1a. User picks client
     st.header("Select Client")
-    all_clients = sorted(client_df["client_name"].unique())
+    all_clients = client_options(csv_path_client)
     selected_client = st.selectbox("Select a client:", all_clients)
 
-    # Filter to that client
-    client_subset = client_df[client_df["client_name"] == selected_client].copy()
-    if client_subset.empty:
+    # 2. Province & Commodity
+    provinces_for_client = province_options(csv_path_client, selected_client)
+    if not provinces_for_client:
         st.warning(f"No data found for client '{selected_client}'.")
         st.stop()
-
-    # 2. Province & Commodity
-    provinces_for_client = sorted(client_subset["province"].unique())
     chosen_province = st.selectbox("Select Province:", provinces_for_client)
 
-    province_subset = client_subset[client_subset["province"] == chosen_province].copy()
-    if province_subset.empty:
+    commodities_for_client_prov = commodity_options(csv_path_client, selected_client, chosen_province)
+    if not commodities_for_client_prov:
         st.warning(f"No data found for {selected_client} in {chosen_province}.")
         st.stop()
-
-    commodities_for_client_prov = sorted(province_subset["commodity"].unique())
     chosen_commodity = st.selectbox("Select Commodity:", commodities_for_client_prov)
 
-    final_subset = province_subset[province_subset["commodity"] == chosen_commodity].copy()
+    # Filter to the selection (a lookup on the sorted client/province/commodity index)
+    final_subset = client_index.loc[[(selected_client, chosen_province, chosen_commodity)]]
     if final_subset.empty:
         st.warning(f"No data found for {selected_client} in {chosen_province} with {chosen_commodity}.")
         st.stop()
@@ -135,23 +73,10 @@ def main():
         ["Aggregate All Sites", "Site-by-Site"]
     )
 
-    import numpy as np
-
     if analysis_mode == "Aggregate All Sites":
-        month_cols = ["January", "February", "March", "April", "May", "June",
-                      "July", "August", "September", "October", "November", "December"]
         earliest_start = final_subset["contract_start_date"].min()
         avg_admin_fee = final_subset["client_admin_fee"].mean()
-        usage_sums = final_subset[month_cols].sum(numeric_only=True)
-
-        month_map = {
-            1: "January", 2: "February", 3: "March", 4: "April",
-            5: "May", 6: "June", 7: "July", 8: "August",
-            9: "September", 10: "October", 11: "November", 12: "December"
-        }
-        consumption = {}
-        for i in range(1, 13):
-            consumption[i] = float(usage_sums[month_map[i]])
+        consumption = client_monthly_totals(csv_path_client, selected_client, chosen_province, chosen_commodity)
 
         final_contract_start = earliest_start
         final_admin_fee = avg_admin_fee
@@ -160,18 +85,10 @@ def main():
         st.write(f"**Earliest Contract Start**: {final_contract_start}")
         st.write(f"**Average Admin Fee**: {final_admin_fee}")
     else:
-        all_site_ids = sorted(final_subset["site_ID"].unique())
+        all_site_ids = site_options(csv_path_client, selected_client, chosen_province, chosen_commodity)
         chosen_site = st.selectbox("Select Site ID:", all_site_ids)
         site_row = final_subset[final_subset["site_ID"] == chosen_site].iloc[0]
-
-        month_map = {
-            1: "January", 2: "February", 3: "March", 4: "April",
-            5: "May", 6: "June", 7: "July", 8: "August",
-            9: "September", 10: "October", 11: "November", 12: "December"
-        }
-        consumption = {}
-        for i in range(1, 13):
-            consumption[i] = float(site_row[month_map[i]])
+        consumption = site_row[list(MONTH_NAMES)].to_numpy(dtype=float)
 
         final_contract_start = site_row["contract_start_date"]
         final_admin_fee = site_row["client_admin_fee"]
@@ -181,9 +98,9 @@ def main():
         st.write(f"**Admin Fee**: {final_admin_fee}")
 
     # Contract start as Timestamp
-    contract_start_ts = pd.to_datetime(final_contract_start)
+    contract_start_ts = pd.Timestamp(final_contract_start)
 
-    # 4. Date Range
+    # 4. Date Range (outside the form, so the hedge start date below is bounded by the current range)
     st.header("Date Range")
     col1, col2 = st.columns(2)
     with col1:
@@ -198,7 +115,7 @@ def main():
             value=datetime(2023, 12, 31)
         )
 
-    # 5. Volumetric Hedge
+    # 5. Volumetric Hedge (the toggle stays outside the form so the hedge fields appear as soon as it is checked)
     st.header("Volumetric Hedge")
     st.write("""
     Define a partial fixed-rate hedge. Check the box below to enable it.
@@ -213,155 +130,87 @@ def main():
     hedge_term_months = 0
     hedge_fixed_rate = 0.0
 
-    if use_hedge:
-        hedge_portion_percent = st.number_input(
-            "Hedged portion of monthly volume (%)",
-            min_value=0.0,
-            max_value=100.0,
-            step=1.0,
-            value=30.0
-        )
-        hedge_start_date_input = st.date_input(
-            "Hedge Start Date",
-            value=start_date_input,
-            min_value=start_date_input,
-            max_value=end_date_input
-        )
-        hedge_term_months = st.number_input("Hedge Term (months)", min_value=0, value=6)
-        hedge_fixed_rate = st.number_input(
-            "Hedge Fixed Rate (All-Inclusive)",
-            min_value=0.0,
-            step=0.1,
-            format="%.2f"
-        )
-
-    # Additional Options
-    st.header("Additional Options")
-    show_monthly_chart = st.checkbox("Show monthly bar chart of costs?", value=True)
-    show_monthly_table = st.checkbox("Show monthly cost table & differences?", value=True)
-
-    # Submit
-    submitted = st.button("Submit", type="primary")
+    # Hedge Details, batched in a form so editing them does not rerun the page until Submit
+    with st.form("current_client_form"):
+        if use_hedge:
+            st.subheader("Hedge Details")
+            hedge_portion_percent = st.number_input(
+                "Hedged portion of monthly volume (%)",
+                min_value=0.0,
+                max_value=100.0,
+                step=1.0,
+                value=30.0
+            )
+            hedge_start_date_input = st.date_input(
+                "Hedge Start Date",
+                value=start_date_input,
+                min_value=start_date_input,
+                max_value=end_date_input
+            )
+            hedge_term_months = st.number_input("Hedge Term (months)", min_value=0, value=6)
+            hedge_fixed_rate = st.number_input(
+                "Hedge Fixed Rate (All-Inclusive)",
+                min_value=0.0,
+                step=0.1,
+                format="%.2f"
+            )
+
+        # Submit
+        submitted = st.form_submit_button("Submit", type="primary")
     if not submitted:
         st.stop()
 
     # Post-submit processing of dates
-    start_ts = pd.to_datetime(start_date_input)
-    end_ts = pd.to_datetime(end_date_input)
+    start_ts = pd.Timestamp(start_date_input)
+    end_ts = pd.Timestamp(end_date_input)
 
     if use_hedge and hedge_start_date_input:
-        hedge_start_ts = pd.to_datetime(hedge_start_date_input)
-        hedge_end_ts = hedge_start_ts + pd.DateOffset(months=int(hedge_term_months))
+        hedge_start_ts = pd.Timestamp(hedge_start_date_input)
+        hedge_end_ts = add_months(hedge_start_ts, int(hedge_term_months))
     else:
         hedge_start_ts = None
         hedge_end_ts = None
 
-    # 6. Pick the appropriate CSV for rates and load it using get_data_path
-    rates_csv = get_rates_csv(chosen_province, chosen_commodity)
+    # 6. Load the cached rates for the province/commodity (required columns are checked on load).
+    if chosen_province == "Ontario" and chosen_commodity == "gas" and not local_utility_choice:
+        st.error("Ontario gas requires selecting EGD or Union South.")
+        st.stop()
     try:
-        df_rates = pd.read_csv(get_data_path(rates_csv), parse_dates=["date"])
+        df_rates = load_rates(chosen_province, chosen_commodity, local_utility_choice)
     except FileNotFoundError:
+        rates_csv = get_rates_csv(chosen_province, chosen_commodity)
         st.error(f"Could not find rates file '{rates_csv}'. Check your files.")
         st.stop()
 
-    # Check required columns in the rates file.
-    if chosen_province == "Alberta":
-        needed_cols = {"date", "regulated_rate", "wholesale_rate"}
-        if not needed_cols.issubset(df_rates.columns):
-            st.error(f"Rates file '{rates_csv}' must have columns: {needed_cols}")
-            st.stop()
-    else:
-        needed_cols = {"date", "wholesale_rate", "local_utility_rate_egd", "local_utility_rate_usouth"}
-        if not needed_cols.issubset(df_rates.columns):
-            st.error(f"Rates file '{rates_csv}' must have columns: {needed_cols}")
-            st.stop()
-
-    st.subheader("Reference Data (Preview)")
-    st.dataframe(df_rates.head())
+    # Previews sit in collapsed expanders, out of the way of the report.
+    with st.expander("Reference Data (Preview)"):
+        st.dataframe(df_rates.head())
 
     # Filter rates to the selected date range.
-    mask = (df_rates["date"] >= start_ts) & (df_rates["date"] <= end_ts)
-    df_filtered = df_rates.loc[mask].copy()
+    # The rates are indexed by sorted date, so this is a binary-search slice.
+    df_filtered = df_rates.loc[start_ts:end_ts]
     if df_filtered.empty:
         st.warning("No rate data in that date range.")
         st.stop()
 
-    # Build "utility_selected" column.
-    if chosen_province == "Alberta":
-        df_filtered["utility_selected"] = df_filtered["regulated_rate"]
-    else:
-        if not local_utility_choice:
-            st.error("Ontario gas requires selecting EGD or Union South.")
-            st.stop()
-        if local_utility_choice == "EGD":
-            df_filtered["utility_selected"] = df_filtered["local_utility_rate_egd"]
-        else:
-            df_filtered["utility_selected"] = df_filtered["local_utility_rate_usouth"]
-
-    # Group monthly.
-    df_filtered["year_month"] = df_filtered["date"].dt.to_period("M")
-    monthly_rates = (
-        df_filtered.groupby("year_month", as_index=False)
-        .agg({
-            "wholesale_rate": "mean",
-            "utility_selected": "mean"
-        })
+    monthly_rates = load_monthly_rates(chosen_province, chosen_commodity, start_ts, end_ts, local_utility_choice)
+
+    with st.expander("Averaged monthly data (filtered by date range)"):
+        st.dataframe(monthly_rates.head())
+
+    # Monthly utility and client costs (vectorized, shared with the new-business page).
+    monthly_df = monthly_cost_breakdown(
+        monthly_rates,
+        consumption,
+        final_admin_fee,
+        get_cost_divisor(chosen_province, chosen_commodity),
+        hedge_portion_percent=hedge_portion_percent,
+        hedge_fixed_rate=hedge_fixed_rate,
+        hedge_start_ts=hedge_start_ts,
+        hedge_end_ts=hedge_end_ts
     )
-    monthly_rates["year_month"] = monthly_rates["year_month"].apply(lambda x: x.start_time)
-    monthly_rates.sort_values("year_month", inplace=True)
-    monthly_rates.reset_index(drop=True, inplace=True)
-
-    st.write("**Averaged monthly data (filtered by date range):**")
-    st.dataframe(monthly_rates.head())
-
-    # Function to compute cost in CAD.
-    def cost_in_cad(usage_value, rate_value, province, commodity):
-        # AB gas: usage * rate ($/GJ)
-        # AB electricity: usage * (rate in cents/kWh / 100)
-        # ON gas: usage * (rate in cents/m³ / 100)
-        if province == "Alberta" and commodity == "gas":
-            return usage_value * rate_value
-        elif province == "Alberta" and commodity == "electricity":
-            return usage_value * (rate_value / 100.0)
-        elif province == "Ontario" and commodity == "gas":
-            return usage_value * (rate_value / 100.0)
-        else:
-            st.error(f"No cost calculation rule for {province}, {commodity}")
-            st.stop()
-
-    monthly_cost_utility = []
-    monthly_cost_client = []
-
-    for _, row_m in monthly_rates.iterrows():
-        month_dt = row_m["year_month"]
-        w_rate = row_m["wholesale_rate"]
-        u_rate = row_m["utility_selected"]
-
-        mnum = pd.Timestamp(month_dt).month
-        usage_val = consumption[mnum]
-
-        # Calculate utility cost.
-        util_cost = cost_in_cad(usage_val, u_rate, chosen_province, chosen_commodity)
-
-        # Calculate client cost.
-        if use_hedge and hedge_start_ts and (hedge_start_ts <= month_dt < hedge_end_ts):
-            hedged_vol = usage_val * (hedge_portion_percent / 100.0)
-            floating_vol = usage_val - hedged_vol
-
-            # Hedged volume: hedge_fixed_rate applies without an extra admin fee.
-            cost_hedged = cost_in_cad(hedged_vol, hedge_fixed_rate, chosen_province, chosen_commodity)
-            # Floating volume: use (wholesale rate + admin fee).
-            cost_floating = cost_in_cad(floating_vol, w_rate + final_admin_fee, chosen_province, chosen_commodity)
-            c_cost = cost_hedged + cost_floating
-        else:
-            combined = w_rate + final_admin_fee
-            c_cost = cost_in_cad(usage_val, combined, chosen_province, chosen_commodity)
-
-        monthly_cost_utility.append(util_cost)
-        monthly_cost_client.append(c_cost)
-
-    total_utility = sum(monthly_cost_utility)
-    total_client = sum(monthly_cost_client)
+    total_utility = monthly_df["Utility Cost (CAD)"].sum()
+    total_client = monthly_df["Client Cost (CAD)"].sum()
 
     st.header("Cost Comparison Report (CAD)")
     colA, colB = st.columns(2)
@@ -379,52 +228,8 @@ def main():
     else:
         st.info("No difference between Utility and Client Cost.")
 
-    # Prepare monthly breakdown.
-    monthly_display = []
-    for i, row_m in enumerate(monthly_rates.itertuples()):
-        date_label = row_m.year_month
-        month_str = pd.Timestamp(date_label).strftime("%b %Y")
-
-        cost_util = monthly_cost_utility[i]
-        cost_client = monthly_cost_client[i]
-        diff_month = cost_util - cost_client
-
-        monthly_data = {
-            "Month": month_str,
-            "Utility Cost (CAD)": cost_util,
-            "Client Cost (CAD)": cost_client,
-            "Diff (Utility - Client)": diff_month
-        }
-        monthly_display.append(monthly_data)
-
-    monthly_df = pd.DataFrame(monthly_display)
-
-    if show_monthly_chart and not monthly_df.empty:
-        st.write("### Monthly Bar Chart of Costs (CAD)")
-        chart_data = monthly_df.melt(
-            id_vars="Month",
-            value_vars=["Utility Cost (CAD)", "Client Cost (CAD)"],
-            var_name="Scenario",
-            value_name="Cost (CAD)"
-        )
-        chart = alt.Chart(chart_data).mark_bar().encode(
-            x=alt.X("Month:N", sort=None, title="Month"),
-            y=alt.Y("Cost (CAD):Q", title="Cost in CAD"),
-            color=alt.Color("Scenario:N", legend=alt.Legend(title="Scenario")),
-            xOffset="Scenario:N"
-        ).properties(width=600, height=400)
-        st.altair_chart(chart, use_container_width=True)
-
-    if show_monthly_table and not monthly_df.empty:
-        st.write("### Monthly Costs & Differences Table (CAD)")
-        format_dict = {
-            "Utility Cost (CAD)": "{:,.2f}",
-            "Client Cost (CAD)": "{:,.2f}",
-            "Diff (Utility - Client)": "{:,.2f}"
-        }
-        existing_cols = list(monthly_df.columns)
-        formatable_cols = {col: format_dict[col] for col in existing_cols if col in format_dict}
-        st.dataframe(monthly_df.style.format(formatable_cols))
+    # Chart and table toggles live in a fragment, so flipping them does not rerun the page.
+    monthly_breakdown(monthly_df)
 
 if __name__ == "__main__":
     main()
@@ -1,33 +1,18 @@
 import streamlit as st
 import pandas as pd
 import datetime
-import re
+import os
 from pathlib import Path
 
+from utils import MONTH_NAMES, check_password, load_clients
+
 # Ensure required dependency is installed
 try:
     import openpyxl
 except ImportError:
     st.error("Missing optional dependency 'openpyxl'. Install it using: pip install openpyxl")
 
-# --- Password Check Function ---
-def check_password():
-    """Returns True if the user entered the correct password."""
-    def password_entered():
-        if st.session_state["password"] and st.session_state["password"] == st.secrets["password"]:
-            st.session_state["password_correct"] = True
-            del st.session_state["password"]  # Remove password from state for security.
-        else:
-            st.session_state["password_correct"] = False
-
-    if st.session_state.get("password_correct", False):
-        return True
-
-    st.text_input("Password", type="password", on_change=password_entered, key="password")
-    if "password_correct" in st.session_state and not st.session_state["password_correct"]:
-        st.error("😕 Password incorrect")
-    return False
-
+# --- Password Check ---
 if not check_password():
     st.stop()
 
@@ -38,9 +23,9 @@ client_csv_path = str(BASE_DIR / "client_data_by_site.csv")
 # Streamlit App Title
 st.title("Consumption Data Standardization")
 
-# 1) Load existing CSV using relative path
+# 1) Load existing CSV using relative path (cached on path + modification time, so an append reloads it)
 try:
-    existing_clients_df = pd.read_csv(client_csv_path)
+    existing_clients_df = load_clients(client_csv_path)
 except FileNotFoundError:
     st.error(f"Could not find the file '{client_csv_path}'. Please ensure it exists.")
     st.stop()
@@ -63,153 +48,141 @@ if "site_ID" not in existing_clients_df.columns:
     existing_clients_df["site_ID"] = None
 
 # Build a dictionary from account_number → site_ID for all existing data
-site_mapping = {}
-for _, row in existing_clients_df.dropna(subset=["site_ID"]).iterrows():
-    site_mapping[row["account_number"]] = row["site_ID"]
+known_sites = existing_clients_df.dropna(subset=["site_ID"])
+site_mapping = dict(zip(known_sites["account_number"], known_sites["site_ID"]))
 
 # Determine the highest numeric portion used so far to keep incrementing
-max_used_site_number = 0
-for sID in site_mapping.values():
-    # Attempt to parse out the integer portion from "Site 001", "Site 0123", etc.
-    match = re.search(r"Site\s+(\d+)", str(sID))
-    if match:
-        num = int(match.group(1))
-        max_used_site_number = max(max_used_site_number, num)
+# (the integer portion of "Site 001", "Site 0123", etc., extracted in one vectorized pass)
+site_numbers = (
+    pd.Series(list(site_mapping.values()), dtype=str)
+    .str.extract(r"Site\s+(\d+)", expand=False)
+    .dropna()
+    .astype(int)
+)
+max_used_site_number = int(site_numbers.max()) if len(site_numbers) else 0
 
 # 3) File upload for new consumption data
 uploaded_file = st.file_uploader("Upload an Excel file (xlsx format)", type=["xlsx"])
 
 if uploaded_file:
     try:
-        xls = pd.ExcelFile(uploaded_file, engine='openpyxl')
-        df = pd.read_excel(xls, sheet_name=xls.sheet_names[0])
+        # Only the first three columns of the first sheet are read, in a single pass over the workbook.
+        df_cleaned = pd.read_excel(uploaded_file, sheet_name=0, usecols=[0, 1, 2], engine="openpyxl")
+    except pd.errors.ParserError:
+        st.error("The uploaded file does not have enough columns. "
+                 "Please ensure it has at least three columns (account_number, date, volume).")
+        st.stop()
     except Exception as e:
         st.error(f"Error reading the uploaded Excel file or sheet: {e}")
         st.stop()
     
-    if len(df.columns) < 3:
-        st.error("The uploaded file does not have enough columns. "
-                 "Please ensure it has at least three columns (account_number, date, volume).")
-    else:
-        # 3a) Clean up the columns
-        df_cleaned = df.iloc[:, :3].copy()
-        df_cleaned.columns = ["account_number", "date", "volume"]
-        
-        df_cleaned["date"] = pd.to_datetime(df_cleaned["date"], errors="coerce")
-        df_cleaned["volume"] = pd.to_numeric(df_cleaned["volume"], errors="coerce")
-        
-        df_cleaned["month"] = df_cleaned["date"].dt.strftime("%B")
-        df_cleaned["year"] = df_cleaned["date"].dt.year
-        
-        # Sort to keep the most recent entry by account_number + date
-        df_cleaned.sort_values(by=["account_number", "date"], ascending=[True, False], inplace=True)
-        
-        # Drop duplicates per (account_number, month)
-        df_deduplicated = df_cleaned.drop_duplicates(subset=["account_number", "month"], keep='first')
-        
-        # Pivot
-        df_pivoted = df_deduplicated.pivot_table(
-            index=["account_number"], 
-            columns="month", 
-            values="volume", 
-            aggfunc="sum"
-        ).reset_index()
-        
-        month_order = [
-            "January", "February", "March", "April", "May", "June", 
-            "July", "August", "September", "October", "November", "December"
-        ]
-        for m in month_order:
-            if m not in df_pivoted.columns:
-                df_pivoted[m] = None
-        
-        df_pivoted = df_pivoted[["account_number"] + month_order]
-        
-        # 3b) Prompt user to pick province & commodity
-        province = st.selectbox("Select Province", ["Ontario", "Alberta", "Quebec"])
-        commodity = st.selectbox("Select Commodity", ["electricity", "natural gas"])
-        
-        # 3c) Also pick the client_name from existing
-        client_names = existing_clients_df["client_name"].unique().tolist()
-        selected_client_name = st.selectbox("Select Existing Client Name", client_names)
-        
-        # Retrieve contract details for that client
-        client_row = existing_clients_df.loc[
-            existing_clients_df["client_name"] == selected_client_name
-        ].iloc[0]
-        contract_start_date = client_row["contract_start_date"]
-        client_admin_fee = client_row["client_admin_fee"]
-        
-        # 3d) Build final dataframe
-        df_pivoted["client_name"] = selected_client_name
-        df_pivoted["contract_start_date"] = contract_start_date
-        df_pivoted["client_admin_fee"] = client_admin_fee
-        df_pivoted["data_as_of"] = datetime.date.today().strftime("%Y-%m-%d")
-        
-        df_pivoted["province"] = province
-        df_pivoted["commodity"] = commodity
-        
-        # 3e) Assign/re-use site_ID
-        new_site_IDs = []
-        for acc in df_pivoted["account_number"]:
-            if acc in site_mapping:
-                new_site_IDs.append(site_mapping[acc])
+    # 3a) Clean up the columns
+    df_cleaned.columns = ["account_number", "date", "volume"]
+    
+    df_cleaned["date"] = pd.to_datetime(df_cleaned["date"], errors="coerce")
+    df_cleaned["volume"] = pd.to_numeric(df_cleaned["volume"], errors="coerce")
+    
+    # Month names are gathered by month number (unparsed dates stay missing) instead of formatted per cell.
+    month_codes = df_cleaned["date"].dt.month.fillna(0).to_numpy(dtype="int64") - 1
+    df_cleaned["month"] = pd.Categorical.from_codes(month_codes, categories=MONTH_NAMES)
+    df_cleaned["year"] = df_cleaned["date"].dt.year
+    
+    # Keep the most recent entry per (account_number, month) with one hashed groupby pass instead of
+    # a full sort; rows without an account or a parsed date (hence month) fall out of the grouping.
+    latest_rows = df_cleaned.groupby(["account_number", "month"], sort=False, observed=True)["date"].idxmax()
+    df_deduplicated = df_cleaned.loc[latest_rows]
+    
+    # Pivot: after the dedup there is one row per (account_number, month), so a plain reshape
+    # replaces the summing pivot_table. As before, an unreadable volume counts as 0, and the
+    # reindex adds any missing months in calendar order.
+    month_order = list(MONTH_NAMES)
+    df_pivoted = (
+        df_deduplicated.fillna({"volume": 0.0})
+        .pivot(index="account_number", columns="month", values="volume")
+        .reindex(columns=month_order)
+        .reset_index()
+    )
+    
+    # 3b) Prompt user to pick province & commodity
+    province = st.selectbox("Select Province", ["Ontario", "Alberta", "Quebec"])
+    commodity = st.selectbox("Select Commodity", ["electricity", "natural gas"])
+    
+    # 3c) Also pick the client_name from existing
+    client_names = existing_clients_df["client_name"].unique().tolist()
+    selected_client_name = st.selectbox("Select Existing Client Name", client_names)
+    
+    # Retrieve contract details for that client
+    client_row = existing_clients_df.loc[
+        existing_clients_df["client_name"] == selected_client_name
+    ].iloc[0]
+    contract_start_date = client_row["contract_start_date"]
+    client_admin_fee = client_row["client_admin_fee"]
+    
+    # 3d) Build final dataframe
+    df_pivoted["client_name"] = selected_client_name
+    df_pivoted["contract_start_date"] = contract_start_date
+    df_pivoted["client_admin_fee"] = client_admin_fee
+    df_pivoted["data_as_of"] = datetime.date.today().strftime("%Y-%m-%d")
+    
+    df_pivoted["province"] = province
+    df_pivoted["commodity"] = commodity
+    
+    # 3e) Assign/re-use site_ID
+    new_site_IDs = []
+    for acc in df_pivoted["account_number"]:
+        if acc in site_mapping:
+            new_site_IDs.append(site_mapping[acc])
+        else:
+            max_used_site_number += 1
+            new_sID = f"Site {max_used_site_number:03d}"
+            site_mapping[acc] = new_sID
+            new_site_IDs.append(new_sID)
+    df_pivoted["site_ID"] = new_site_IDs
+    
+    final_columns = [
+        "client_name",
+        "site_ID",
+        "account_number",
+        "contract_start_date",
+        "client_admin_fee",
+        "province",
+        "commodity",
+        "data_as_of"
+    ] + month_order
+    
+    df_final = df_pivoted[final_columns]
+    
+    # Show final processed data.
+    st.write("### Processed Data")
+    st.dataframe(df_final)
+    
+    # Offer download
+    csv_content = df_final.to_csv(index=False).encode('utf-8')
+    st.download_button(
+        "Download Processed CSV", 
+        csv_content, 
+        "cleaned_consumption_data.csv", 
+        "text/csv"
+    )
+    
+    # Optionally append back to CSV
+    st.write("### Append to Existing CSV")
+    if st.button("Append Data to client_data_by_site.csv"):
+        try:
+            # Only the header is read, to line the new rows up with the file's column order
+            existing_cols = pd.read_csv(client_csv_path, nrows=0).columns
+            if set(df_final.columns) <= set(existing_cols):
+                # Append just the new rows instead of rewriting the whole file
+                with open(client_csv_path, "rb+") as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                df_final.reindex(columns=existing_cols).to_csv(client_csv_path, mode="a", header=False, index=False)
             else:
-                max_used_site_number += 1
-                new_sID = f"Site {max_used_site_number:03d}"
-                site_mapping[acc] = new_sID
-                new_site_IDs.append(new_sID)
-        df_pivoted["site_ID"] = new_site_IDs
-        
-        final_columns = [
-            "client_name",
-            "site_ID",
-            "account_number",
-            "contract_start_date",
-            "client_admin_fee",
-            "province",
-            "commodity",
-            "data_as_of"
-        ] + month_order
-        
-        df_final = df_pivoted[final_columns]
-        
-        # Show final processed data.
-        st.write("### Processed Data")
-        st.dataframe(df_final)
-        
-        # Offer download
-        csv_content = df_final.to_csv(index=False).encode('utf-8')
-        st.download_button(
-            "Download Processed CSV", 
-            csv_content, 
-            "cleaned_consumption_data.csv", 
-            "text/csv"
-        )
-        
-        # Optionally append back to CSV
-        st.write("### Append to Existing CSV")
-        if st.button("Append Data to client_data_by_site.csv"):
-            try:
-                # Reload to ensure fresh
+                # The file lacks some of the new columns (e.g. site_ID), so it is rewritten with them added
                 existing_data = pd.read_csv(client_csv_path)
-                if "site_ID" not in existing_data.columns:
-                    existing_data["site_ID"] = None
-                
                 combined_df = pd.concat([existing_data, df_final], ignore_index=True)
-                
-                # (Optional) remove duplicates if desired:
-                # combined_df.drop_duplicates(
-                #     subset=[
-                #         "client_name", "account_number", 
-                #         "contract_start_date", "data_as_of", 
-                #         "province", "commodity"
-                #     ],
-                #     keep='first',
-                #     inplace=True
-                # )
-                
                 combined_df.to_csv(client_csv_path, index=False)
-                st.success(f"Data appended to '{client_csv_path}' successfully!")
-            except Exception as e:
-                st.error(f"Failed to append to '{client_csv_path}': {e}")
+            st.success(f"Data appended to '{client_csv_path}' successfully!")
+        except Exception as e:
+            st.error(f"Failed to append to '{client_csv_path}': {e}")
@@ -1,7 +1,4 @@
 import streamlit as st
-import pandas as pd
-import altair as alt
-from datetime import datetime
 # Import pages if necessary, but avoid invoking them directly here
 # from pages import current_client, new_business_on_gas
 
@@ -0,0 +1,527 @@
+import calendar
+import hmac
+import os
+from pathlib import Path
+
+import altair as alt
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+import streamlit as st
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; monthly averages fall back to pandas without it
+    njit = None
+
+BASE_DIR = Path(__file__).resolve().parent
+
+MONTH_NAMES = ("January", "February", "March", "April", "May", "June",
+               "July", "August", "September", "October", "November", "December")
+
+# Columns the simulator pages need from the client site file.
+CLIENT_REQUIRED_COLUMNS = frozenset({
+    "client_name", "site_ID", "province", "commodity",
+    "contract_start_date", "client_admin_fee", *MONTH_NAMES
+})
+
+# Explicit numeric types for the client site file, so the parser skips inference.
+CLIENT_DTYPES = {name: "float64" for name in (*MONTH_NAMES, "client_admin_fee")}
+
+# --- Authentication ---
+
+def check_password():
+    """Returns `True` if the user had the correct password."""
+    def password_entered():
+        """Checks whether a password entered by the user is correct."""
+        # compare_digest only accepts ASCII str, so compare the encoded bytes instead.
+        if st.session_state["password"] and hmac.compare_digest(
+            st.session_state["password"].encode(), st.secrets["password"].encode()
+        ):
+            st.session_state["password_correct"] = True
+            del st.session_state["password"]  # Don't store the password.
+        else:
+            st.session_state["password_correct"] = False
+
+    if st.session_state.get("password_correct", False):
+        return True
+
+    st.text_input("Password", type="password", on_change=password_entered, key="password")
+    if "password_correct" in st.session_state and not st.session_state["password_correct"]:
+        st.error("😕 Password incorrect")
+    return False
+
+# --- Data Path Helpers ---
+
+def get_data_path(filename):
+    """
+    Returns the absolute path to a data file based on its expected location:
+      - If the file is "client_data_by_site.csv", it is assumed to be in the repository root.
+      - If the filename starts with "historical_", it is assumed to be in the 'market-data' folder.
+      - Otherwise, the file is assumed to be in a 'data' folder at the repository root.
+    """
+    if filename == "client_data_by_site.csv":
+        return str(BASE_DIR / filename)
+    elif filename.startswith("historical_"):
+        return str(BASE_DIR / "market-data" / filename)
+    else:
+        return str(BASE_DIR / "data" / filename)
+
+# Historical rates file for each supported (province, commodity) pair.
+RATES_FILES = {
+    ("Alberta", "gas"): "historical_data_AB_gas.csv",
+    ("Alberta", "electricity"): "historical_data_AB_ele.csv",
+    ("Ontario", "gas"): "historical_data_ON_gas.csv",
+    ("Quebec", "gas"): "historical_data_QC_gas.csv",
+}
+
+def get_rates_csv(province, commodity):
+    """
+    Returns the appropriate historical rates CSV filename based on province and commodity.
+    """
+    try:
+        return RATES_FILES[(province, commodity)]
+    except KeyError:
+        st.error(f"No rate file rule for province={province}, commodity={commodity}")
+        st.stop()
+
+def get_utility_column(province, utility_choice=None):
+    """
+    Returns the rates column holding the local utility / regulated rate:
+      - Alberta: regulated_rate
+      - Quebec: utility_rate
+      - Ontario: the EGD rate unless "Union South" is chosen
+    """
+    if province == "Alberta":
+        return "regulated_rate"
+    elif province == "Quebec":
+        return "utility_rate"
+    elif utility_choice == "Union South":
+        return "local_utility_rate_usouth"
+    else:
+        return "local_utility_rate_egd"
+
+# Divisor turning usage * rate into CAD: Alberta gas is priced in $/GJ, the others in cents per unit.
+COST_DIVISOR = {
+    ("Alberta", "gas"): 1.0,
+    ("Alberta", "electricity"): 100.0,
+    ("Ontario", "gas"): 100.0,
+    ("Quebec", "gas"): 100.0,
+}
+
+def get_cost_divisor(province, commodity):
+    """
+    Returns the divisor turning usage * rate into CAD for a province/commodity:
+      - For Alberta gas: 1 (rate in $/GJ)
+      - For Alberta electricity: 100 (rate in cents/kWh)
+      - For Ontario and Quebec gas: 100 (rate in cents/m³)
+    """
+    try:
+        return COST_DIVISOR[(province, commodity)]
+    except KeyError:
+        st.error(f"No cost calculation rule for {province}, {commodity}")
+        st.stop()
+
+# --- Cached Loaders ---
+
+def _downcast_float(series):
+    """
+    Returns the series as float32 (half the bytes to scan) when every value survives
+    the round trip exactly; otherwise returns it unchanged so costs are not perturbed.
+    """
+    narrow = series.astype("float32")
+    if narrow.astype("float64").equals(series.astype("float64")):
+        return narrow
+    return series
+
+def _source(filepath):
+    """
+    Returns (path, mtime) of the file to read for `filepath`: its Parquet copy written by
+    write_parquet_copies() when that is at least as new, otherwise the file itself.
+    Raises FileNotFoundError if neither exists.
+    """
+    parquet_path = str(Path(filepath).with_suffix(".parquet"))
+    try:
+        parquet_mtime = os.path.getmtime(parquet_path)
+    except FileNotFoundError:
+        return filepath, os.path.getmtime(filepath)
+    try:
+        mtime = os.path.getmtime(filepath)
+    except FileNotFoundError:
+        return parquet_path, parquet_mtime
+    if mtime > parquet_mtime:
+        return filepath, mtime
+    return parquet_path, parquet_mtime
+
+def _check_columns(df, filepath, required_columns):
+    missing = set(required_columns) - set(df.columns) - set(df.index.names)
+    if missing:
+        st.error(f"The file '{filepath}' is missing required columns: {sorted(missing)}")
+        st.stop()
+
+@st.cache_data(show_spinner=False)
+def _load_csv_cached(filepath, mtime, dtype=None):
+    # `mtime` is only part of the cache key, so editing the file invalidates the entry.
+    if filepath.endswith(".parquet"):
+        # Parquet copies are written already typed, so there is nothing to parse.
+        return pd.read_parquet(filepath)
+    return pd.read_csv(filepath, engine="pyarrow", dtype=dtype)
+
+def load_csv(filepath, required_columns=(), dtype=None):
+    """
+    Loads a CSV (or its up-to-date Parquet copy) through the Streamlit cache, keyed on
+    path + modification time. Raises FileNotFoundError if the file is missing, and stops the app with an
+    error if any of `required_columns` are absent.
+    """
+    df = _load_csv_cached(*_source(filepath), dtype)
+    _check_columns(df, filepath, required_columns)
+    return df
+
+def load_clients(filepath, required_columns=()):
+    """
+    Loads the client site file with explicit numeric types.
+    """
+    return load_csv(filepath, required_columns, dtype=CLIENT_DTYPES)
+
+@st.cache_resource(show_spinner=False)
+def _load_rates_cached(filepath, mtime, utility_col):
+    # A resource: one frame per file version is shared by every session and never copied, so callers must not mutate it.
+    # Only read the columns the simulation uses; missing ones are reported by the caller.
+    is_parquet = filepath.endswith(".parquet")
+    header = pq.read_schema(filepath).names if is_parquet else pd.read_csv(filepath, nrows=0).columns
+    usecols = [col for col in ("date", "wholesale_rate", utility_col) if col in header]
+    if "date" not in usecols:
+        # Nothing to index by; return the bare header so load_rates reports the missing columns.
+        return pd.DataFrame(columns=usecols)
+    if is_parquet:
+        # Columns are stored typed, so nothing is parsed and unused columns are never read.
+        df = pd.read_parquet(filepath, columns=usecols)
+    else:
+        # Read straight into Arrow with a fixed schema, so no column type is inferred.
+        table = pacsv.read_csv(
+            filepath,
+            convert_options=pacsv.ConvertOptions(
+                include_columns=usecols,
+                column_types={col: pa.timestamp("us") if col == "date" else pa.float64() for col in usecols}
+            )
+        )
+        df = table.to_pandas()
+    for col in usecols:
+        if col != "date":
+            df[col] = _downcast_float(df[col])
+    if utility_col in df.columns:
+        df["utility_selected"] = df[utility_col]
+    # A sorted DatetimeIndex lets callers slice a date range with a binary search.
+    # Parquet copies are written pre-sorted, so the sort is skipped for them.
+    if not df["date"].is_monotonic_increasing:
+        df = df.sort_values("date")
+    df = df.set_index("date")
+    # Flag files with at most one row per month once here, so monthly_rate_means can skip averaging.
+    months = df.index.to_numpy().astype("datetime64[M]")
+    df.attrs["one_row_per_month"] = bool((months[1:] != months[:-1]).all())
+    return df
+
+def load_rates(province, commodity, utility_choice=None):
+    """
+    Loads the historical rates for a province/commodity, shared by every page,
+    from the Parquet copy when there is an up-to-date one.
+    Only the date, wholesale and selected utility columns are read. The
+    "utility_selected" column is materialized once per utility choice inside
+    the cache rather than on every rerun, and the frame is indexed by sorted date.
+    The frame is shared across sessions: slice it, but never modify it in place.
+    """
+    filepath = get_data_path(get_rates_csv(province, commodity))
+    utility_col = get_utility_column(province, utility_choice)
+    df = _load_rates_cached(*_source(filepath), utility_col)
+    _check_columns(df, filepath, {"date", "wholesale_rate", utility_col})
+    return df
+
+def write_parquet_copies():
+    """
+    Writes a typed Parquet copy next to the client site file and every historical rates
+    CSV (the rates sorted by date), so the loaders can skip CSV parsing. Run
+    `python utils.py` after updating a CSV; until then the newer CSV is read instead.
+    """
+    client_path = get_data_path("client_data_by_site.csv")
+    df = pd.read_csv(client_path, engine="pyarrow", dtype=CLIENT_DTYPES)
+    df.to_parquet(Path(client_path).with_suffix(".parquet"), compression="zstd", index=False)
+
+    for filename in RATES_FILES.values():
+        csv_path = get_data_path(filename)
+        df = pd.read_csv(csv_path, engine="pyarrow", parse_dates=["date"])
+        df = df.astype({col: "float64" for col in df.columns if col != "date"})
+        df = df.sort_values("date", kind="stable")
+        df.to_parquet(
+            Path(csv_path).with_suffix(".parquet"),
+            compression="zstd",
+            index=False,
+            row_group_size=128_000
+        )
+
+@st.cache_data(show_spinner=False)
+def _load_client_index_cached(filepath, mtime):
+    df = _load_csv_cached(filepath, mtime, CLIENT_DTYPES)
+    return df.set_index(["client_name", "province", "commodity"]).sort_index()
+
+def load_client_index(filepath, required_columns=()):
+    """
+    Returns the client site file indexed by a sorted (client_name, province, commodity)
+    MultiIndex, so each cascading selection is an index lookup instead of a column scan.
+    """
+    df = _load_client_index_cached(*_source(filepath))
+    _check_columns(df, filepath, required_columns)
+    return df
+
+# Selector options are cached per upstream selection, so a rerun does not rescan the file.
+
+@st.cache_data(show_spinner=False)
+def _client_options_cached(filepath, mtime):
+    index = _load_client_index_cached(filepath, mtime).index
+    return tuple(index.get_level_values("client_name").unique())
+
+@st.cache_data(show_spinner=False)
+def _province_options_cached(filepath, mtime, client):
+    index = _load_client_index_cached(filepath, mtime)
+    # A header-only file leaves the selectboxes empty, so their value is None.
+    if client not in index.index:
+        return ()
+    subset = index.loc[client]
+    return tuple(subset.index.get_level_values("province").unique())
+
+@st.cache_data(show_spinner=False)
+def _commodity_options_cached(filepath, mtime, client, province):
+    index = _load_client_index_cached(filepath, mtime)
+    if (client, province) not in index.index:
+        return ()
+    subset = index.loc[(client, province)]
+    return tuple(subset.index.unique())
+
+@st.cache_data(show_spinner=False)
+def _site_options_cached(filepath, mtime, client, province, commodity):
+    index = _load_client_index_cached(filepath, mtime)
+    if (client, province, commodity) not in index.index:
+        return ()
+    subset = index.loc[[(client, province, commodity)]]
+    return tuple(sorted(subset["site_ID"].unique()))
+
+def client_options(filepath):
+    """
+    Returns the sorted, de-duplicated client names of the client site file.
+    """
+    return _client_options_cached(*_source(filepath))
+
+def province_options(filepath, client):
+    """
+    Returns the sorted provinces a client has sites in.
+    """
+    return _province_options_cached(*_source(filepath), client)
+
+def commodity_options(filepath, client, province):
+    """
+    Returns the sorted commodities a client has sites for in a province.
+    """
+    return _commodity_options_cached(*_source(filepath), client, province)
+
+def site_options(filepath, client, province, commodity):
+    """
+    Returns the sorted site IDs of a client for a province and commodity.
+    """
+    return _site_options_cached(*_source(filepath), client, province, commodity)
+
+@st.cache_data(show_spinner=False)
+def _client_monthly_totals_cached(filepath, mtime):
+    df = _load_client_index_cached(filepath, mtime)
+    return df.groupby(level=["client_name", "province", "commodity"])[list(MONTH_NAMES)].sum()
+
+def client_monthly_totals(filepath, client, province, commodity):
+    """
+    Returns the monthly consumption of all of a client's sites for a province and
+    commodity as a 12-element array (index 0 is January). The totals of every
+    selection are computed once per file, so this is a single lookup.
+    """
+    totals = _client_monthly_totals_cached(*_source(filepath))
+    return totals.loc[(client, province, commodity)].to_numpy(dtype=float)
+
+# --- Monthly Aggregation ---
+
+def _accumulate_monthly(month_ord, values):
+    # One pass over the sorted daily rows, summing each column per month and skipping NaNs.
+    first = month_ord[0]
+    n_months = month_ord[-1] - first + 1
+    sums = np.zeros((n_months, values.shape[1]))
+    counts = np.zeros((n_months, values.shape[1]))
+    for i in range(len(month_ord)):
+        m = month_ord[i] - first
+        for j in range(values.shape[1]):
+            v = values[i, j]
+            if not np.isnan(v):
+                sums[m, j] += v
+                counts[m, j] += 1
+    return sums, counts
+
+if njit is not None:
+    _accumulate_monthly = njit(cache=True)(_accumulate_monthly)
+
+def _reduce_monthly(month_ord, values):
+    # The rows are date-sorted, so each month is one contiguous run: sum the runs with
+    # reduceat instead of hashing every row into a groupby table.
+    starts = np.flatnonzero(np.r_[True, np.diff(month_ord) != 0])
+    valid = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(valid, values, 0.0), starts, axis=0)
+    counts = np.add.reduceat(valid.astype(np.int64), starts, axis=0)
+    return month_ord[starts], sums, counts
+
+def monthly_rate_means(df_filtered):
+    """
+    Averages the date-indexed wholesale and utility rates per calendar month.
+    Returns a frame with "year_month" (month start), "wholesale_rate" and
+    "utility_selected", skipping months with no rates at all. Rates loaded with
+    one row per month are used as they are; otherwise a compiled single-pass
+    kernel is used when numba is installed, and NumPy run sums when it is not.
+    """
+    columns = ["wholesale_rate", "utility_selected"]
+    if df_filtered.empty:
+        return pd.DataFrame({
+            "year_month": pd.Series(dtype=df_filtered.index.dtype),
+            **{col: pd.Series(dtype="float64") for col in columns}
+        })
+    month_ord = df_filtered.index.to_numpy().astype("datetime64[M]").astype(np.int64)
+    values = df_filtered[columns].to_numpy(dtype=np.float64)
+    if df_filtered.attrs.get("one_row_per_month"):
+        # Already monthly: each row is its month's mean.
+        means = values
+    else:
+        if njit is not None:
+            sums, counts = _accumulate_monthly(month_ord, values)
+            month_ord = month_ord[0] + np.arange(len(sums))
+        else:
+            month_ord, sums, counts = _reduce_monthly(month_ord, values)
+        with np.errstate(invalid="ignore"):
+            means = sums / counts
+    months = month_ord.astype("datetime64[M]").astype(df_filtered.index.dtype)
+    monthly_rates = pd.DataFrame({"year_month": months, columns[0]: means[:, 0], columns[1]: means[:, 1]})
+    return monthly_rates.dropna(subset=columns, how="all").reset_index(drop=True)
+
+@st.cache_data(show_spinner=False)
+def _monthly_rates_cached(filepath, mtime, utility_col, start_ts, end_ts):
+    df = _load_rates_cached(filepath, mtime, utility_col)
+    return monthly_rate_means(df.loc[start_ts:end_ts])
+
+def load_monthly_rates(province, commodity, start_ts, end_ts, utility_choice=None):
+    """
+    Returns monthly_rate_means of the rates between start_ts and end_ts, cached per
+    date window so re-submitting with other fees, consumption or hedge terms skips
+    the aggregation. Each call returns a fresh copy, so callers may add columns.
+    """
+    filepath = get_data_path(get_rates_csv(province, commodity))
+    utility_col = get_utility_column(province, utility_choice)
+    return _monthly_rates_cached(*_source(filepath), utility_col, start_ts, end_ts)
+
+def window_mask(months, start_ts, end_ts):
+    """
+    Returns a boolean mask of the sorted `months` series falling in [start_ts, end_ts),
+    located with two binary searches instead of comparing every row.
+    """
+    lo, hi = months.searchsorted([start_ts, end_ts], side="left")
+    mask = np.zeros(len(months), dtype=bool)
+    mask[lo:hi] = True
+    return mask
+
+def add_months(ts, months):
+    """
+    Returns `ts` moved forward by whole calendar months, clamping the day to the end of
+    the target month (as pd.DateOffset does) without going through the offset machinery.
+    """
+    total = ts.month - 1 + months
+    year, month = ts.year + total // 12, total % 12 + 1
+    return ts.replace(year=year, month=month, day=min(ts.day, calendar.monthrange(year, month)[1]))
+
+# --- Cost Calculation ---
+
+def monthly_cost_breakdown(monthly_rates, consumption, admin_fee, divisor, hedge_portion_percent=0.0,
+                           hedge_fixed_rate=0.0, hedge_start_ts=None, hedge_end_ts=None, client_usage=None):
+    """
+    Returns the monthly breakdown ("Month", "Utility Cost (CAD)", "Client Cost (CAD)",
+    "Diff (Utility - Client)") for the averaged `monthly_rates`, where `consumption` is a
+    12-element array (index 0 is January) and `divisor` converts rates to CAD per unit.
+    The utility cost uses the actual consumption; the client cost uses `client_usage`
+    instead when given (e.g. equalized Bundle-T volume). Between hedge_start_ts and
+    hedge_end_ts the hedged share is billed at the all-inclusive fixed rate with no
+    admin fee, and the rest floats at wholesale + admin fee.
+    """
+    usage = consumption[monthly_rates["year_month"].dt.month.to_numpy() - 1]
+    usage_client = usage if client_usage is None else client_usage
+    # Rates converted to CAD per unit once, so each cost below is a single multiply.
+    floating_rate_cad = (monthly_rates["wholesale_rate"].to_numpy() + admin_fee) / divisor
+    cost_utility = usage * (monthly_rates["utility_selected"].to_numpy() / divisor)
+
+    if hedge_start_ts is not None:
+        hedge_mask = window_mask(monthly_rates["year_month"], hedge_start_ts, hedge_end_ts)
+        hedge_share = hedge_portion_percent / 100.0
+        # Blended per-unit rate of a hedged month, so the client cost is a single multiply by usage.
+        hedged_rate_cad = hedge_share * (hedge_fixed_rate / divisor) + (1.0 - hedge_share) * floating_rate_cad
+        cost_client = usage_client * np.where(hedge_mask, hedged_rate_cad, floating_rate_cad)
+    else:
+        # No hedge: every month is floating, so no mask is built.
+        cost_client = usage_client * floating_rate_cad
+
+    return pd.DataFrame({
+        "Month": monthly_rates["year_month"].dt.strftime("%b %Y"),
+        "Utility Cost (CAD)": cost_utility,
+        "Client Cost (CAD)": cost_client,
+        "Diff (Utility - Client)": cost_utility - cost_client
+    })
+
+# --- Charts ---
+
+COST_SCENARIOS = ("Utility Cost (CAD)", "Client Cost (CAD)")
+
+@st.cache_resource
+def _cost_bar_chart_template():
+    # Built once per process; each render only attaches new data to a copy of it.
+    # The cost columns are folded into Scenario / Cost (CAD) rows by Vega in the browser.
+    return alt.Chart().transform_fold(list(COST_SCENARIOS), as_=["Scenario", "Cost (CAD)"]).mark_bar().encode(
+        x=alt.X("Month:N", sort=None, title="Month"),
+        y=alt.Y("Cost (CAD):Q", title="Cost in CAD"),
+        color=alt.Color("Scenario:N", legend=alt.Legend(title="Scenario")),
+        xOffset="Scenario:N"
+    ).properties(width=600, height=400)
+
+def cost_bar_chart(chart_data):
+    """
+    Returns the grouped monthly cost bar chart for wide-form data with a
+    "Month" column and one column per cost scenario.
+    """
+    return _cost_bar_chart_template().properties(data=chart_data)
+
+# --- Report Sections ---
+
+@st.fragment
+def monthly_breakdown(monthly_df):
+    """
+    Renders the monthly cost chart and table with their display toggles. As a
+    fragment, toggling a checkbox redraws only this section instead of rerunning
+    the page, so the rates are not reloaded and the report stays on screen.
+    """
+    st.subheader("Display Options")
+    show_monthly_chart = st.checkbox("Show monthly bar chart of costs?", value=True, key="show_monthly_chart")
+    show_monthly_table = st.checkbox("Show monthly cost table & differences?", value=True, key="show_monthly_table")
+
+    if show_monthly_chart and not monthly_df.empty:
+        st.write("### Monthly Bar Chart of Costs (CAD)")
+        # Sent wide, one row per month; the chart reshapes it client-side.
+        chart_data = monthly_df[["Month", *COST_SCENARIOS]]
+        st.altair_chart(cost_bar_chart(chart_data), use_container_width=True)
+
+    if show_monthly_table and not monthly_df.empty:
+        st.write("### Monthly Costs & Differences Table (CAD)")
+        # Amounts stay numeric (so the columns sort as numbers) and are formatted by the frontend.
+        amount_format = st.column_config.NumberColumn(format="%,.2f")
+        amount_cols = [col for col in (*COST_SCENARIOS, "Diff (Utility - Client)") if col in monthly_df.columns]
+        st.dataframe(monthly_df, column_config=dict.fromkeys(amount_cols, amount_format))
+
+
+if __name__ == "__main__":
+    write_parquet_copies()